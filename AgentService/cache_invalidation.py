@@ -0,0 +1,177 @@
+import threading
+import logging
+from time import monotonic, sleep
+from cachetools import TTLCache
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+# TTL cache keyed by (user_id, ...) tuples that can drop all of a user's entries.
+#
+# Entries live for `ttl` while change-stream invalidation is healthy; when it
+# is not, anything older than `fallback_ttl` is treated as a miss.
+#
+# Readers that populate the cache from Mongo take generation() before
+# reading and store with set_if_current(), so a view read before an eviction
+# is not cached after it.
+class InvalidatingCache:
+    def __init__(self, maxsize, ttl, fallback_ttl, is_healthy=lambda: False, max_tracked_evictions=10000):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.fallback_ttl = fallback_ttl
+        self.is_healthy = is_healthy
+        self.max_tracked_evictions = max_tracked_evictions
+        # Eviction sequence numbers: per user, and a floor covering clear()
+        # and users dropped from tracking
+        self._seq = 0
+        self._floor = 0
+        self._evicted = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return default
+            value, stored_at = entry
+            if not self.is_healthy() and monotonic() - stored_at > self.fallback_ttl:
+                self._cache.pop(key, None)
+                return default
+            return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._cache[key] = (value, monotonic())
+
+    def generation(self):
+        with self._lock:
+            return self._seq
+
+    # Store value unless the key's user was evicted since generation() was taken
+    def set_if_current(self, key, value, generation):
+        with self._lock:
+            if max(self._floor, self._evicted.get(key[0], 0)) > generation:
+                return False
+            self._cache[key] = (value, monotonic())
+            return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cache)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._cache.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def evict_user(self, user_id):
+        with self._lock:
+            keys = [key for key in self._cache.keys() if key[0] == user_id]
+            for key in keys:
+                self._cache.pop(key, None)
+            self._seq += 1
+            self._evicted[user_id] = self._seq
+            if len(self._evicted) > self.max_tracked_evictions:
+                # Forgetting users is safe once the floor covers them
+                self._floor = self._seq
+                self._evicted.clear()
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._seq += 1
+            self._floor = self._seq
+            self._evicted.clear()
+
+
+# Watches roadmaps/progress/ai_chats for writes from any worker and evicts the
+# affected user's cache entries in this process.
+#
+# on_change(collection, user_id) runs for each change; user_id is None when
+# the owner cannot be told (deletes), and callers should then clear broadly.
+# on_reset() runs on every (re)connect, since changes may have been missed.
+class ChangeStreamInvalidator:
+    def __init__(self, db, user_fields, on_change, on_reset, max_retry_delay=60):
+        self.db = db
+        self.user_fields = user_fields
+        self.on_change = on_change
+        self.on_reset = on_reset
+        self.max_retry_delay = max_retry_delay
+        self.healthy = False
+        self.events = 0
+        self.attempted = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="cache-invalidator", daemon=True)
+        self._thread.start()
+        return self
+
+    # Block until the first connection attempt has finished, either way
+    def wait_started(self, timeout=None):
+        return self.attempted.wait(timeout)
+
+    def stats(self):
+        return {"healthy": self.healthy, "events": self.events, "collections": list(self.user_fields)}
+
+    def _run(self):
+        retry_delay = 1
+        resume_token = None
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self.user_fields)}}}]
+        while True:
+            connected = False
+            try:
+                with self.db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    connected = True
+                    # Without a resume point, changes made meanwhile are unknown
+                    if resume_token is None:
+                        self.on_reset()
+                    if not self.healthy:
+                        logger.info("✅ Cache invalidation change stream connected")
+                    self.healthy = True
+                    retry_delay = 1
+                    self.attempted.set()
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        self._handle(change)
+                        if change.get("operationType") == "invalidate":
+                            resume_token = None
+                            break
+            except Exception as e:
+                # Any failure (not just PyMongoError) must drop trust in the caches;
+                # a dead thread with healthy=True would keep them for the full TTL
+                if self.healthy:
+                    logger.warning(f"⚠️ Cache invalidation stream lost, using short TTLs: {str(e)}")
+                elif retry_delay == 1:
+                    logger.warning(f"⚠️ Change streams unavailable, using short TTLs: {str(e)}")
+                self.healthy = False
+                self.attempted.set()
+                if not connected or not isinstance(e, PyMongoError):
+                    # The resume point (or the event after it) may be the problem; start fresh
+                    resume_token = None
+                sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+
+    def _handle(self, change):
+        self.events += 1
+        collection = change.get("ns", {}).get("coll")
+        try:
+            if change.get("operationType") in ("drop", "rename", "dropDatabase", "invalidate"):
+                self.on_change(collection, None)
+                return
+            document = change.get("fullDocument") or {}
+            self.on_change(collection, document.get(self.user_fields.get(collection)))
+        except Exception as e:
+            logger.error(f"❌ Cache invalidation handler failed: {str(e)}")
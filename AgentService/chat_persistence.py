@@ -0,0 +1,315 @@
+import threading
+import queue
+import logging
+import traceback
+from datetime import datetime
+from time import monotonic, sleep
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+logger = logging.getLogger(__name__)
+
+PERSIST_MODES = ("sync", "async", "async_flush_on_shutdown")
+
+
+# Write-behind buffer for chat transcripts.
+# Messages are queued in-process and pushed to Mongo with batched bulk_write
+# once CHAT_FLUSH_BATCH messages are waiting or CHAT_FLUSH_INTERVAL has passed.
+#
+# on_write(user_ids) runs on the flusher right after a write and must be quick
+# (cache eviction); on_flush(user_id) runs on its own worker so slow follow-up
+# work never holds up flushing.
+class ChatWriteBuffer:
+    def __init__(self, collection, mode="async_flush_on_shutdown", max_size=1000,
+                 batch_size=50, flush_interval=1.0, max_retries=3, on_write=None, on_flush=None):
+        if mode not in PERSIST_MODES:
+            raise ValueError(f"Unknown chat persistence mode: {mode}")
+
+        self.collection = collection
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.on_write = on_write
+        self.on_flush = on_flush
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._pending = {}
+        # Guards _pending, plus the users whose batch is being written and a
+        # counter bumped once each write's messages leave _pending
+        self._pending_lock = threading.Condition()
+        self._writing = set()
+        self._generation = 0
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._callbacks = queue.Queue()
+        self._callback_users = set()
+        self._callback_lock = threading.Lock()
+        if on_flush:
+            threading.Thread(target=self._run_callbacks, name="chat-flush-callbacks", daemon=True).start()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "flushed_messages": 0,
+            "flush_count": 0,
+            "failed_flushes": 0,
+            "dropped_messages": 0,
+            "unconfirmed_messages": 0,
+            "sync_fallbacks": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+        if mode != "sync":
+            self._thread = threading.Thread(target=self._run, name="chat-write-buffer", daemon=True)
+            self._thread.start()
+            logger.info(f"✅ Chat write-behind buffer started (mode={mode}, max_size={max_size}, "
+                        f"batch={batch_size}, interval={flush_interval}s)")
+
+    # Queue messages for a user; writes through when running sync.
+    # When the queue is full, waits up to flush_interval for room, then writes
+    # through once the user's earlier messages are stored, keeping their order.
+    def append(self, user_id, messages):
+        if self.mode == "sync":
+            self._write_through(user_id, messages)
+            return
+
+        deadline = monotonic() + self.flush_interval
+        with self._pending_lock:
+            while True:
+                try:
+                    self._queue.put_nowait((user_id, list(messages)))
+                except queue.Full:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    # Woken after each flushed batch
+                    self._pending_lock.wait(remaining)
+                    continue
+                self._pending.setdefault(user_id, []).extend(messages)
+                self._bump("enqueued", len(messages))
+                return
+
+            logger.warning(f"⚠️ Chat buffer full, writing synchronously for user {user_id}")
+            # The flusher always makes progress (writing or dropping), so this
+            # only gives up once it has stopped
+            while not self._pending_lock.wait_for(lambda: user_id not in self._pending, timeout=1.0):
+                if not self._thread.is_alive():
+                    logger.warning(f"⚠️ Earlier chat messages for user {user_id} still unflushed; order may differ")
+                    break
+        self._bump("sync_fallbacks")
+        self._write_through(user_id, messages)
+
+    # Run read_stored() and return (its result, pending messages) as one
+    # consistent view: retried if a write for the user overlapped the read,
+    # so a flushing batch is never seen both in Mongo and in pending
+    def read_with_pending(self, user_id, read_stored):
+        while True:
+            with self._pending_lock:
+                self._pending_lock.wait_for(lambda: user_id not in self._writing)
+                generation = self._generation
+            stored = read_stored()
+            with self._pending_lock:
+                if user_id not in self._writing and self._generation == generation:
+                    return stored, list(self._pending.get(user_id, []))
+
+    # Drain and write everything currently queued
+    def flush(self):
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    # Stop the flusher; flush remaining messages unless mode is plain async.
+    # Queued on_flush callbacks are dropped; they are only follow-up work.
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            # Long enough for an in-flight batch to finish its retries
+            self._thread.join(timeout=self.flush_interval * 2 + 0.5 * 2 ** self.max_retries)
+        if self.mode == "async_flush_on_shutdown":
+            remaining = self._queue.qsize()
+            self.flush()
+            logger.info(f"✅ Chat buffer flushed {remaining} queued entries on shutdown")
+        elif self._queue.qsize():
+            logger.warning(f"⚠️ Chat buffer closed with {self._queue.qsize()} unflushed entries")
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        flushes = stats.pop("total_flush_ms")
+        stats["avg_flush_ms"] = round(flushes / stats["flush_count"], 2) if stats["flush_count"] else 0.0
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        stats["callback_backlog"] = self._callbacks.qsize()
+        stats["mode"] = self.mode
+        return stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain(block=True)
+            if batch:
+                self._write_batch(batch)
+
+    # Collect up to batch_size entries, waiting at most flush_interval after the first
+    def _drain(self, block):
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            else:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+
+        count = len(batch[0][1])
+        deadline = monotonic() + self.flush_interval
+        while count < self.batch_size:
+            remaining = deadline - monotonic()
+            try:
+                if block and remaining > 0:
+                    entry = self._queue.get(timeout=remaining)
+                else:
+                    entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(entry)
+            count += len(entry[1])
+        return batch
+
+    def _write_batch(self, batch):
+        # One $push per user keeps message order and batch size small
+        grouped = {}
+        for user_id, messages in batch:
+            grouped.setdefault(user_id, []).extend(messages)
+
+        with self._flush_lock:
+            with self._pending_lock:
+                self._writing.update(grouped)
+            self._push_with_retries(dict(grouped))
+
+            self._written(list(grouped))
+            with self._pending_lock:
+                for user_id, messages in grouped.items():
+                    pending = self._pending.get(user_id, [])
+                    del pending[:len(messages)]
+                    if not pending:
+                        self._pending.pop(user_id, None)
+                self._writing.difference_update(grouped)
+                self._generation += 1
+                self._pending_lock.notify_all()
+
+        self._notify(list(grouped))
+
+    # $push is not idempotent: retry only what is known not to have been written.
+    # pymongo already retries once when the outcome is unknown; those are not retried again.
+    def _push_with_retries(self, remaining):
+        retry_delay = 0.5
+        for attempt in range(self.max_retries):
+            user_ids = list(remaining)
+            message_count = sum(len(messages) for messages in remaining.values())
+            # Stamped per attempt so updatedAt is never older than the write
+            now = datetime.now()
+            operations = [
+                UpdateOne(
+                    {"userId": user_id},
+                    {"$push": {"messages": {"$each": remaining[user_id]}}, "$set": {"updatedAt": now}},
+                    upsert=True
+                )
+                for user_id in user_ids
+            ]
+            start = monotonic()
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+                self._record_flush(message_count, (monotonic() - start) * 1000)
+                return
+            except BulkWriteError as e:
+                failed = {user_ids[error["index"]] for error in e.details.get("writeErrors", [])}
+                if e.details.get("writeConcernErrors"):
+                    self._give_up(remaining, "unconfirmed_messages", e)
+                    return
+                written = sum(len(messages) for user_id, messages in remaining.items() if user_id not in failed)
+                if written:
+                    self._record_flush(written, (monotonic() - start) * 1000)
+                remaining = {user_id: remaining[user_id] for user_id in user_ids if user_id in failed}
+                error = e
+            except ServerSelectionTimeoutError as e:
+                # No server was reached, so nothing was written
+                error = e
+            except Exception as e:
+                self._give_up(remaining, "unconfirmed_messages", e)
+                return
+
+            self._bump("failed_flushes")
+            if attempt < self.max_retries - 1:
+                logger.warning(f"⚠️ Chat flush failed, retrying in {retry_delay}s: {str(error)}")
+                sleep(retry_delay)
+                retry_delay *= 2
+        self._give_up(remaining, "dropped_messages", error)
+
+    def _give_up(self, remaining, stat, error):
+        message_count = sum(len(messages) for messages in remaining.values())
+        if stat == "unconfirmed_messages":
+            self._bump("failed_flushes")
+            logger.error(f"❌ Chat flush outcome unknown for {message_count} messages, not retrying: {str(error)}")
+        else:
+            logger.error(f"❌ Dropping {message_count} chat messages after {self.max_retries} attempts: {str(error)}")
+        traceback.print_exception(type(error), error, error.__traceback__)
+        self._bump(stat, message_count)
+
+    def _write_through(self, user_id, messages):
+        self.collection.update_one(
+            {"userId": user_id},
+            {"$push": {"messages": {"$each": list(messages)}}, "$set": {"updatedAt": datetime.now()}},
+            upsert=True
+        )
+        self._written([user_id])
+        self._notify([user_id])
+
+    def _written(self, user_ids):
+        if not self.on_write:
+            return
+        try:
+            self.on_write(user_ids)
+        except Exception as e:
+            logger.error(f"❌ Chat write callback failed: {str(e)}")
+
+    # Hand users to the callback worker, at most once while still queued
+    def _notify(self, user_ids):
+        if not self.on_flush:
+            return
+        with self._callback_lock:
+            for user_id in user_ids:
+                if user_id not in self._callback_users:
+                    self._callback_users.add(user_id)
+                    self._callbacks.put(user_id)
+
+    def _run_callbacks(self):
+        while True:
+            user_id = self._callbacks.get()
+            with self._callback_lock:
+                self._callback_users.discard(user_id)
+            try:
+                self.on_flush(user_id)
+            except Exception as e:
+                logger.error(f"❌ Chat flush callback failed for user {user_id}: {str(e)}")
+
+    def _record_flush(self, message_count, elapsed_ms):
+        with self._stats_lock:
+            self._stats["flushed_messages"] += message_count
+            self._stats["flush_count"] += 1
+            self._stats["last_batch_size"] = message_count
+            self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+            self._stats["max_flush_ms"] = round(max(self._stats["max_flush_ms"], elapsed_ms), 2)
+            self._stats["total_flush_ms"] += elapsed_ms
+        logger.info(f"✅ Flushed {message_count} chat messages in {elapsed_ms:.1f}ms")
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
@@ -0,0 +1,92 @@
+import threading
+import queue
+import logging
+import traceback
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+# Collects concurrent requests over a short window and processes them together.
+#
+# process_batch(payloads) returns one result per payload, or None for payloads
+# it could not handle; those (and single-request windows) go through
+# process_single(payload) on the submitting thread.
+class MicroBatcher:
+    def __init__(self, process_batch, process_single, window=0.5, max_batch=8, name="micro-batcher"):
+        self.process_batch = process_batch
+        self.process_single = process_single
+        self.window = window
+        self.max_batch = max_batch
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {"submitted": 0, "batches": 0, "batched_requests": 0, "individual_fallbacks": 0, "batch_errors": 0}
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # Block until the payload has been processed in a batch or individually
+    def submit(self, payload):
+        entry = {"payload": payload, "done": threading.Event(), "result": None, "batched": False, "missed": False}
+        self._bump("submitted")
+        self._queue.put(entry)
+        entry["done"].wait()
+
+        if entry["batched"]:
+            return entry["result"]
+        if entry["missed"]:
+            self._bump("individual_fallbacks")
+        return self.process_single(payload)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["waiting"] = self._queue.qsize()
+        stats["window_ms"] = int(self.window * 1000)
+        stats["max_batch"] = self.max_batch
+        return stats
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if len(batch) == 1:
+                batch[0]["done"].set()
+                continue
+            # Keep collecting the next window while this batch waits on the model
+            threading.Thread(target=self._process, args=(batch,), daemon=True).start()
+
+    def _process(self, batch):
+        try:
+            results = list(self.process_batch([entry["payload"] for entry in batch]))
+            results += [None] * (len(batch) - len(results))
+            self._bump("batches")
+        except Exception as e:
+            logger.error(f"❌ {self.name} batch of {len(batch)} failed: {str(e)}")
+            traceback.print_exc()
+            self._bump("batch_errors")
+            results = [None] * len(batch)
+
+        for entry, result in zip(batch, results):
+            if result is not None:
+                entry["result"] = result
+                entry["batched"] = True
+                self._bump("batched_requests")
+            else:
+                entry["missed"] = True
+            entry["done"].set()
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
@@ -0,0 +1,12 @@
+import os
+from pymongo import MongoClient
+
+DATABASE_NAME = "skilling_tracker"
+
+
+# MongoDB handle shared by the app and the maintenance CLIs.
+# Connecting is lazy in pymongo; nothing here creates indexes or starts threads.
+def get_database(event_listeners=None):
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+    client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000, event_listeners=event_listeners or [])
+    return client[DATABASE_NAME]
@@ -0,0 +1,180 @@
+"""Stream roadmaps, progress and chat transcripts out of Mongo as NDJSON.
+
+Usage:
+    python ndjson_export.py [roadmaps progress ai_chats] [--out-dir exports] [--since 2026-01-01T00:00:00] [--gzip]
+
+Each collection is written to <out-dir>/<collection>.ndjson[.gz], one document
+per line. Documents are read from a cursor in --batch-size chunks and written
+as they arrive, so memory use does not grow with the collection. Pass the
+"until" timestamp logged at the end of a run as --since to the next run for an
+incremental export. "until" defaults to --lag seconds ago, so writes stamped
+just before it but committed a little later are still picked up next time.
+"""
+import os
+import json
+import zlib
+import logging
+from datetime import datetime, timedelta
+from time import monotonic
+
+logger = logging.getLogger("ndjson_export")
+
+# Collection -> timestamp field used for incremental filters
+EXPORT_FIELDS = {
+    "roadmaps": "updated_at",
+    "progress": "updated_at",
+    "ai_chats": "updatedAt",
+}
+
+# Seconds the default "until" trails the clock
+EXPORT_SAFETY_LAG = int(os.getenv("EXPORT_SAFETY_LAG", "60"))
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+# Default upper bound for an export: now minus the safety lag
+def export_watermark(lag=EXPORT_SAFETY_LAG):
+    return datetime.now() - timedelta(seconds=lag)
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value} (expected ISO 8601)")
+
+
+# Documents, bytes and elapsed time of one export
+class ExportStats:
+    def __init__(self, collection_name):
+        self.collection = collection_name
+        self.documents = 0
+        self.bytes = 0
+        self.started = monotonic()
+
+    def as_dict(self):
+        elapsed = monotonic() - self.started
+        return {
+            "collection": self.collection,
+            "documents": self.documents,
+            "bytes": self.bytes,
+            "elapsed_s": round(elapsed, 2),
+            "docs_per_s": round(self.documents / elapsed, 1) if elapsed > 0 else 0.0,
+            "mb_per_s": round(self.bytes / elapsed / 1024 / 1024, 2) if elapsed > 0 else 0.0,
+        }
+
+    def log(self, final=False):
+        stats = self.as_dict()
+        logger.info(f"{'✅' if final else '📊'} {stats['collection']}: {stats['documents']} documents, "
+                    f"{stats['bytes'] / 1024 / 1024:.1f}MB in {stats['elapsed_s']}s "
+                    f"({stats['docs_per_s']} docs/s, {stats['mb_per_s']} MB/s)")
+
+
+# Yield NDJSON chunks of up to batch_size documents each.
+# Sorted by the timestamp field so an interrupted run can resume from the last line.
+def export_chunks(collection, since=None, until=None, batch_size=500, stats=None, report_every=10000):
+    field = EXPORT_FIELDS[collection.name]
+    query = {}
+    if since or until:
+        query[field] = {}
+        if since:
+            query[field]["$gt"] = since
+        if until:
+            query[field]["$lte"] = until
+    if until and not since:
+        # A full export also includes documents written before the field existed
+        query = {"$or": [query, {field: None}]}
+
+    cursor = collection.find(query).sort(field, 1).batch_size(batch_size)
+    try:
+        lines = []
+        for doc in cursor:
+            lines.append(json.dumps(doc, default=_json_default, ensure_ascii=False))
+            if len(lines) >= batch_size:
+                yield _encode(lines, stats, report_every)
+                lines = []
+        if lines:
+            yield _encode(lines, stats, report_every)
+    finally:
+        cursor.close()
+        if stats:
+            stats.log(final=True)
+
+
+def _encode(lines, stats, report_every):
+    chunk = ("\n".join(lines) + "\n").encode("utf-8")
+    if stats:
+        before = stats.documents
+        stats.documents += len(lines)
+        stats.bytes += len(chunk)
+        if report_every and stats.documents // report_every > before // report_every:
+            stats.log()
+    return chunk
+
+
+# Gzip a stream of chunks incrementally
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_to_file(collection, out_dir, since=None, until=None, batch_size=500, compress=False, report_every=10000):
+    path = os.path.join(out_dir, f"{collection.name}.ndjson{'.gz' if compress else ''}")
+    stats = ExportStats(collection.name)
+    chunks = export_chunks(collection, since, until, batch_size, stats, report_every)
+    if compress:
+        chunks = gzip_chunks(chunks)
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    result = stats.as_dict()
+    result["path"] = path
+    result["file_bytes"] = os.path.getsize(path)
+    return result
+
+
+def main():
+    import argparse
+    from mongo_store import get_database
+
+    parser = argparse.ArgumentParser(description="Export collections as newline-delimited JSON")
+    parser.add_argument("collections", nargs="*",
+                        help=f"collections to export: {', '.join(EXPORT_FIELDS)} (default: all)")
+    parser.add_argument("--out-dir", default="exports", help="directory for the export files")
+    parser.add_argument("--since", help="only documents updated after this ISO timestamp")
+    parser.add_argument("--until", help="only documents updated at or before this ISO timestamp (default: now - lag)")
+    parser.add_argument("--lag", type=int, default=EXPORT_SAFETY_LAG,
+                        help="seconds the default --until trails the clock, covering writes still in flight")
+    parser.add_argument("--batch-size", type=int, default=500, help="cursor batch size")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output files")
+    parser.add_argument("--report-every", type=int, default=10000, help="log throughput every N documents")
+    args = parser.parse_args()
+    unknown = [name for name in args.collections if name not in EXPORT_FIELDS]
+    if unknown:
+        parser.error(f"unknown collection(s): {', '.join(unknown)} (choose from {', '.join(EXPORT_FIELDS)})")
+    args.collections = args.collections or list(EXPORT_FIELDS)
+
+    logging.basicConfig(level=logging.INFO)
+    since = parse_timestamp(args.since)
+    # Pin the upper bound so the next incremental run can start exactly here
+    until = parse_timestamp(args.until) or export_watermark(args.lag)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    db = get_database()
+    for name in args.collections:
+        export_to_file(db[name], args.out_dir, since, until, max(args.batch_size, 1), args.gzip, args.report_every)
+    logger.info(f"✅ Export complete; use --since {until.isoformat()} for the next incremental run")
+
+
+if __name__ == "__main__":
+    main()
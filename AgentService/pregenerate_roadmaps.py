@@ -0,0 +1,233 @@
+"""Pre-generate roadmaps for a cohort before their sessions start.
+
+Usage:
+    python pregenerate_roadmaps.py users.txt [--concurrency 4] [--rpm 30] [--batch-size 1]
+
+The input file holds one user id per line, or JSON lines of the form
+{"user_id": "...", "assessment": [...]} to skip the Node.js assessment fetch.
+Finished users are appended to a checkpoint file, so rerunning the same
+command resumes where the previous run stopped.
+"""
+import os
+import json
+import uuid
+import argparse
+import threading
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic, sleep
+from pymongo import ReplaceOne
+
+import app as agent
+
+logger = logging.getLogger("pregenerate_roadmaps")
+
+
+# Spaces out model calls so the run stays under a requests-per-minute budget
+class RateLimiter:
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm > 0 else 0
+        self._next = monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            sleep(start - now)
+
+
+def load_users(path):
+    users = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                users.append((entry.get("user_id") or entry.get("userId"), entry.get("assessment")))
+            else:
+                users.append((line, None))
+    return users
+
+
+def load_checkpoint(path):
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("status") in ("done", "skipped"):
+                finished.add(entry["user_id"])
+    return finished
+
+
+class Pregenerator:
+    def __init__(self, args):
+        self.args = args
+        self.limiter = RateLimiter(args.rpm)
+        self.checkpoint_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending_docs = []
+        self.counts = {"done": 0, "skipped": 0, "failed": 0}
+        self.started = monotonic()
+        self.total = 0
+
+    # Generate roadmaps for a chunk of (user_id, assessment) entries
+    def process_chunk(self, chunk):
+        prepared = []
+        for user_id, assessment_data in chunk:
+            if assessment_data is None:
+                assessment_data = agent.fetch_assessment_data(user_id, self.args.token)
+            if not assessment_data:
+                self.record(user_id, "failed", reason="no assessment")
+            else:
+                prepared.append((assessment_data, user_id))
+
+        results = [None] * len(prepared)
+        if len(prepared) > 1:
+            self.limiter.wait()
+            try:
+                results = agent.generate_roadmaps_batch(prepared)
+            except Exception as e:
+                logger.warning(f"⚠️ Batch of {len(prepared)} failed, generating individually: {str(e)}")
+
+        for (assessment_data, user_id), result in zip(prepared, results):
+            if result is None:
+                self.limiter.wait()
+                result = agent.generate_roadmap_from_assessment(assessment_data, user_id)
+            roadmap_steps, is_fallback = result
+            if is_fallback:
+                # Leave the user for the next run instead of storing a generic roadmap
+                self.record(user_id, "failed", reason="model fallback")
+                continue
+            doc = agent.build_roadmap_doc(user_id, str(uuid.uuid4()), roadmap_steps, assessment_data, False)
+            self.queue_doc(user_id, doc)
+
+    def queue_doc(self, user_id, doc):
+        with self.write_lock:
+            self.pending_docs.append((user_id, doc))
+            if len(self.pending_docs) >= self.args.flush_size:
+                self.flush_locked()
+
+    def flush(self):
+        with self.write_lock:
+            self.flush_locked()
+
+    # Users are checkpointed only after their roadmap is written
+    def flush_locked(self):
+        if not self.pending_docs:
+            return
+        user_ids = [user_id for user_id, _ in self.pending_docs]
+        old_roadmaps = {
+            doc["user_id"]: doc for doc in agent.roadmaps_collection.find(
+                {"user_id": {"$in": user_ids}}, {"user_id": 1, "steps": 1, "sector": 1, "assessment_summary": 1}
+            )
+        }
+        completed = {}
+        for record in agent.progress_collection.find({"user_id": {"$in": user_ids}, "completed": True}, {"user_id": 1, "step_id": 1}):
+            completed.setdefault(record["user_id"], set()).add(record["step_id"])
+
+        # Stamp at write time; docs can wait here long after they were generated
+        now = datetime.now()
+        for _, doc in self.pending_docs:
+            doc["updated_at"] = now
+        agent.roadmaps_collection.bulk_write(
+            [ReplaceOne({"user_id": user_id}, doc, upsert=True) for user_id, doc in self.pending_docs],
+            ordered=False
+        )
+        logger.info(f"✅ Upserted {len(self.pending_docs)} roadmaps")
+        for user_id, doc in self.pending_docs:
+            agent.progress_analytics.record_roadmap_change(old_roadmaps.get(user_id), doc, completed.get(user_id, set()))
+            self.record(user_id, "done")
+        self.pending_docs = []
+
+    def record(self, user_id, status, **detail):
+        entry = {"user_id": user_id, "status": status}
+        entry.update(detail)
+        with self.checkpoint_lock:
+            with open(self.args.checkpoint, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.counts[status] += 1
+            processed = sum(self.counts.values())
+        if status == "failed":
+            logger.warning(f"⚠️ User {user_id} failed: {detail.get('reason')}")
+        if processed % self.args.report_every == 0 or processed == self.total:
+            self.report(processed)
+
+    def report(self, processed):
+        elapsed = monotonic() - self.started
+        rate = processed / elapsed if elapsed > 0 else 0
+        remaining = (self.total - processed) / rate if rate > 0 else 0
+        logger.info(f"📊 {processed}/{self.total} processed "
+                    f"(done={self.counts['done']}, skipped={self.counts['skipped']}, failed={self.counts['failed']}) "
+                    f"{rate * 60:.1f} users/min, ETA {remaining:.0f}s")
+
+    def run(self, users):
+        finished = load_checkpoint(self.args.checkpoint)
+        users = [(user_id, assessment) for user_id, assessment in users if user_id and user_id not in finished]
+        if finished:
+            logger.info(f"🔄 Resuming: {len(finished)} users already finished")
+
+        if not self.args.overwrite and users:
+            existing = {
+                doc["user_id"] for doc in agent.roadmaps_collection.find(
+                    {"user_id": {"$in": [user_id for user_id, _ in users]}, "is_fallback": {"$ne": True}},
+                    {"user_id": 1}
+                )
+            }
+            for user_id in existing:
+                self.record(user_id, "skipped", reason="roadmap exists")
+            users = [(user_id, assessment) for user_id, assessment in users if user_id not in existing]
+
+        self.total = len(users) + self.counts["skipped"]
+        logger.info(f"🚀 Generating roadmaps for {len(users)} users "
+                    f"(concurrency={self.args.concurrency}, rpm={self.args.rpm}, batch={self.args.batch_size})")
+
+        chunks = [users[i:i + self.args.batch_size] for i in range(0, len(users), self.args.batch_size)]
+        try:
+            with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+                futures = [pool.submit(self.process_chunk, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"❌ Chunk failed: {str(e)}")
+        finally:
+            self.flush()
+            self.report(sum(self.counts.values()))
+        return self.counts["failed"] == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate roadmaps for a list of users")
+    parser.add_argument("input", help="file of user ids, or JSON lines with user_id and assessment")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <input>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel generation workers")
+    parser.add_argument("--rpm", type=int, default=int(os.getenv("GEMINI_RPM_LIMIT", "30")),
+                        help="max model calls per minute (0 for no limit)")
+    parser.add_argument("--batch-size", type=int, default=1, help="users packed into one prompt")
+    parser.add_argument("--flush-size", type=int, default=50, help="roadmaps per bulk upsert")
+    parser.add_argument("--report-every", type=int, default=10, help="log progress every N users")
+    parser.add_argument("--token", default=os.getenv("BACKEND_TOKEN"), help="bearer token for the Node.js API")
+    parser.add_argument("--overwrite", action="store_true", help="regenerate users that already have a roadmap")
+    args = parser.parse_args()
+    args.checkpoint = args.checkpoint or f"{args.input}.checkpoint"
+    args.batch_size = min(max(args.batch_size, 1), agent.ROADMAP_BATCH_MAX)
+
+    ok = Pregenerator(args).run(load_users(args.input))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import logging
+import traceback
+from collections import defaultdict
+from datetime import datetime
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Assessment question whose answer is treated as the user's sector of interest
+SECTOR_QUESTION = os.getenv("SECTOR_QUESTION", "Which subject do you enjoy the most?")
+
+
+# Sector label derived from an assessment (falls back to the first answer)
+def assessment_sector(assessment_data):
+    answers = [
+        (item.get('questionText', item.get('question', '')), item.get('selectedOption', item.get('answer')))
+        for item in (assessment_data or [])
+    ]
+    for question, answer in answers:
+        if question == SECTOR_QUESTION and answer:
+            return str(answer)
+    return str(answers[0][1]) if answers and answers[0][1] else "Unknown"
+
+
+def roadmap_sector(roadmap):
+    return roadmap.get("sector") or assessment_sector(roadmap.get("assessment_summary"))
+
+
+def _nsqf_key(step):
+    try:
+        return str(int(step.get("nsqf_level")))
+    except (TypeError, ValueError):
+        return "unknown"
+
+
+def _counter_ids(step, sector):
+    return [
+        ("step", step["step_id"]),
+        ("nsqf", _nsqf_key(step)),
+        ("sector", sector),
+    ]
+
+
+# Counters for completion per step, NSQF level and sector across all users.
+#
+# Each counter is one document {_id: "<kind>:<key>", assigned, completed},
+# kept current with $inc on every roadmap save and progress change, so reads
+# cost one small query however many users there are.
+class ProgressAnalytics:
+    def __init__(self, collection):
+        self.collection = collection
+
+    # A user completed (delta=1) or un-completed (delta=-1) one step
+    def record_step_change(self, roadmap, step_id, delta):
+        step = next((step for step in roadmap.get("steps", []) if step["step_id"] == step_id), None)
+        if step is None:
+            return
+        deltas = defaultdict(lambda: defaultdict(int))
+        for kind, key in _counter_ids(step, roadmap_sector(roadmap)):
+            deltas[(kind, key)]["completed"] += delta
+        deltas[("totals", "all")]["completed"] += delta
+        self._apply(deltas)
+
+    # A user's roadmap was created or replaced; completed_step_ids are their progress records
+    def record_roadmap_change(self, old_roadmap, new_roadmap, completed_step_ids):
+        deltas = defaultdict(lambda: defaultdict(int))
+        if old_roadmap:
+            self._add_roadmap(deltas, old_roadmap, completed_step_ids, -1)
+        if new_roadmap:
+            self._add_roadmap(deltas, new_roadmap, completed_step_ids, 1)
+        self._apply(deltas)
+
+    def summary(self):
+        groups = {"step": [], "nsqf": [], "sector": []}
+        totals = {"roadmaps": 0, "assigned": 0, "completed": 0}
+        updated_at = None
+        for doc in self.collection.find({}):
+            if doc.get("updated_at") and (updated_at is None or doc["updated_at"] > updated_at):
+                updated_at = doc["updated_at"]
+            if doc["kind"] == "totals":
+                totals = {name: doc.get(name, 0) for name in totals}
+                continue
+            assigned = doc.get("assigned", 0)
+            completed = doc.get("completed", 0)
+            groups.setdefault(doc["kind"], []).append({
+                "key": doc["key"],
+                "assigned": assigned,
+                "completed": completed,
+                "completion_rate": round(completed / assigned * 100, 1) if assigned > 0 else 0
+            })
+        for entries in groups.values():
+            entries.sort(key=lambda entry: (len(str(entry["key"])), str(entry["key"])))
+        totals["completion_rate"] = round(totals["completed"] / totals["assigned"] * 100, 1) if totals["assigned"] > 0 else 0
+        return {
+            "steps": groups["step"],
+            "nsqf_levels": groups["nsqf"],
+            "sectors": groups["sector"],
+            "totals": totals,
+            "updated_at": updated_at.isoformat() if updated_at else None
+        }
+
+    # Recompute every counter from the roadmaps and progress collections.
+    # Counters are built in a side collection and swapped in with a rename.
+    def rebuild(self, roadmaps_collection, progress_collection, batch_size=500):
+        completed_by_user = defaultdict(set)
+        for record in progress_collection.find({"completed": True}, {"user_id": 1, "step_id": 1}).batch_size(batch_size):
+            completed_by_user[record["user_id"]].add(record["step_id"])
+
+        deltas = defaultdict(lambda: defaultdict(int))
+        users = 0
+        projection = {"user_id": 1, "steps.step_id": 1, "steps.nsqf_level": 1, "sector": 1, "assessment_summary": 1}
+        for roadmap in roadmaps_collection.find({}, projection).batch_size(batch_size):
+            self._add_roadmap(deltas, roadmap, completed_by_user.get(roadmap["user_id"], set()), 1)
+            users += 1
+
+        staging = self.collection.database[f"{self.collection.name}_rebuild"]
+        staging.drop()
+        self._apply(deltas, staging)
+        if staging.estimated_document_count():
+            staging.rename(self.collection.name, dropTarget=True)
+        else:
+            self.collection.delete_many({})
+        logger.info(f"✅ Rebuilt progress analytics from {users} roadmaps ({len(deltas)} counters)")
+        return users
+
+    def _add_roadmap(self, deltas, roadmap, completed_step_ids, sign):
+        sector = roadmap_sector(roadmap)
+        for step in roadmap.get("steps", []):
+            done = step["step_id"] in completed_step_ids
+            for counter in _counter_ids(step, sector) + [("totals", "all")]:
+                deltas[counter]["assigned"] += sign
+                if done:
+                    deltas[counter]["completed"] += sign
+        deltas[("totals", "all")]["roadmaps"] += sign
+
+    def _apply(self, deltas, collection=None):
+        collection = self.collection if collection is None else collection
+        now = datetime.now()
+        operations = []
+        for (kind, key), counts in deltas.items():
+            counts = {name: value for name, value in counts.items() if value}
+            if not counts:
+                continue
+            operations.append(UpdateOne(
+                {"_id": f"{kind}:{key}"},
+                {"$inc": counts, "$set": {"updated_at": now}, "$setOnInsert": {"kind": kind, "key": key}},
+                upsert=True
+            ))
+        if not operations:
+            return
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # Counters can be repaired with a rebuild; never fail the caller
+            logger.error(f"❌ Failed to update progress analytics: {str(e)}")
+            traceback.print_exc()
+
+
+if __name__ == "__main__":
+    import argparse
+    from mongo_store import get_database
+
+    parser = argparse.ArgumentParser(description="Progress analytics maintenance")
+    parser.add_argument("command", choices=["rebuild"],
+                        help="rebuild: recompute all counters from Mongo (progress changed mid-run may need a second run)")
+    parser.add_argument("--batch-size", type=int, default=500, help="cursor batch size")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = get_database()
+    ProgressAnalytics(db["progress_analytics"]).rebuild(db["roadmaps"], db["progress"], args.batch_size)
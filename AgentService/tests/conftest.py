@@ -0,0 +1,66 @@
+import os
+import sys
+import shutil
+import socket
+import subprocess
+from time import monotonic, sleep
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def wait_for(condition, timeout=10, interval=0.05):
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if condition():
+            return True
+        sleep(interval)
+    return condition()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Single-node replica set (change streams need one).
+# Uses TEST_MONGO_REPLSET_URI if set, otherwise starts mongod from PATH.
+@pytest.fixture(scope="session")
+def replica_set_uri(tmp_path_factory):
+    pymongo = pytest.importorskip("pymongo")
+
+    uri = os.getenv("TEST_MONGO_REPLSET_URI")
+    if uri:
+        yield uri
+        return
+
+    mongod = shutil.which("mongod")
+    if not mongod:
+        pytest.skip("needs mongod on PATH or TEST_MONGO_REPLSET_URI")
+
+    port = _free_port()
+    process = subprocess.Popen(
+        [mongod, "--replSet", "rs0", "--port", str(port), "--bind_ip", "127.0.0.1",
+         "--dbpath", str(tmp_path_factory.mktemp("replset")), "--quiet"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    uri = f"mongodb://127.0.0.1:{port}/?directConnection=true"
+    client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=500)
+    try:
+        def ping():
+            try:
+                return client.admin.command("ping")["ok"] == 1
+            except pymongo.errors.PyMongoError:
+                return False
+
+        assert wait_for(ping, timeout=30), "mongod did not start"
+        client.admin.command("replSetInitiate", {"_id": "rs0", "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]})
+        assert wait_for(lambda: client.admin.command("hello").get("isWritablePrimary"), timeout=30), \
+            "replica set did not elect a primary"
+        yield uri
+    finally:
+        client.close()
+        process.terminate()
+        process.wait(timeout=30)
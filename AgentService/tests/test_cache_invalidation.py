@@ -0,0 +1,155 @@
+import sys
+import subprocess
+from time import sleep
+
+import pytest
+
+pytest.importorskip("cachetools")
+pymongo = pytest.importorskip("pymongo")
+
+from cache_invalidation import InvalidatingCache, ChangeStreamInvalidator
+from conftest import wait_for
+
+WRITER = """
+import sys
+from pymongo import MongoClient
+MongoClient(sys.argv[1])["cache_invalidation_test"]["roadmaps"].insert_one({"user_id": sys.argv[2]})
+"""
+
+
+def start_invalidator(db, cache):
+    return ChangeStreamInvalidator(
+        db,
+        {"roadmaps": "user_id"},
+        on_change=lambda collection, user_id: cache.evict_user(user_id) if user_id else cache.clear(),
+        on_reset=cache.clear,
+        max_retry_delay=1
+    ).start()
+
+
+def test_write_from_another_process_evicts_only_that_user(replica_set_uri):
+    client = pymongo.MongoClient(replica_set_uri)
+    invalidator = None
+    cache = InvalidatingCache(maxsize=100, ttl=3600, fallback_ttl=0.2, is_healthy=lambda: invalidator.healthy)
+    invalidator = start_invalidator(client["cache_invalidation_test"], cache)
+    assert invalidator.wait_started(timeout=10)
+    assert invalidator.healthy
+
+    cache[("writer", "roadmap_view")] = {"steps": []}
+    cache[("bystander", "roadmap_view")] = {"steps": []}
+
+    subprocess.run([sys.executable, "-c", WRITER, replica_set_uri, "writer"], check=True, timeout=30)
+
+    assert wait_for(lambda: ("writer", "roadmap_view") not in cache)
+    # A healthy stream keeps other entries past the fallback TTL
+    sleep(0.3)
+    assert ("bystander", "roadmap_view") in cache
+    client.close()
+
+
+def test_fallback_ttl_applies_while_stream_is_down():
+    # Nothing listens on port 1, so the stream never connects
+    client = pymongo.MongoClient("mongodb://127.0.0.1:1/?directConnection=true", serverSelectionTimeoutMS=200)
+    invalidator = None
+    cache = InvalidatingCache(maxsize=100, ttl=3600, fallback_ttl=0.2, is_healthy=lambda: invalidator.healthy)
+    invalidator = start_invalidator(client["cache_invalidation_test"], cache)
+    assert invalidator.wait_started(timeout=10)
+    assert not invalidator.healthy
+
+    cache[("user", "roadmap_view")] = {"steps": []}
+    assert cache.get(("user", "roadmap_view")) == {"steps": []}
+    sleep(0.3)
+    assert cache.get(("user", "roadmap_view")) is None
+    client.close()
+
+
+def test_view_read_before_eviction_is_not_cached():
+    cache = InvalidatingCache(maxsize=100, ttl=3600, fallback_ttl=30, is_healthy=lambda: True)
+
+    generation = cache.generation()
+    cache.evict_user("user")
+    assert not cache.set_if_current(("user", "roadmap_view"), "stale", generation)
+    assert ("user", "roadmap_view") not in cache
+
+    # Other users' reads are unaffected
+    assert cache.set_if_current(("other", "roadmap_view"), "fresh", generation)
+
+    generation = cache.generation()
+    cache.clear()
+    assert not cache.set_if_current(("other", "roadmap_view"), "stale", generation)
+
+
+# Minimal db.watch() stand-in: each call plays the next scripted stream
+class ScriptedStreams:
+    def __init__(self, streams):
+        self.streams = list(streams)
+        self.resume_points = []
+
+    def watch(self, pipeline, full_document=None, resume_after=None):
+        self.resume_points.append(resume_after)
+        events = self.streams.pop(0) if self.streams else []
+        return ScriptedStream(events)
+
+
+class ScriptedStream:
+    def __init__(self, events):
+        self.events = events
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        for event in self.events:
+            if isinstance(event, Exception):
+                raise event
+            self.resume_token = {"_data": event["id"]}
+            yield event
+        # Block like an open stream with no further changes
+        while True:
+            sleep(0.05)
+
+
+def test_failing_reset_marks_stream_unhealthy_and_reconnects():
+    resets = []
+
+    def on_reset():
+        resets.append(1)
+        if len(resets) == 1:
+            raise RuntimeError("reset failed")
+
+    db = ScriptedStreams([[], []])
+    invalidator = ChangeStreamInvalidator(db, {"roadmaps": "user_id"}, on_change=lambda *args: None,
+                                          on_reset=on_reset, max_retry_delay=0.05).start()
+    assert invalidator.wait_started(timeout=5)
+    assert wait_for(lambda: len(resets) == 2 and invalidator.healthy, timeout=5)
+
+
+def test_non_mongo_stream_error_resets_resume_point():
+    cache = InvalidatingCache(maxsize=100, ttl=3600, fallback_ttl=30)
+    event = {"id": "1", "operationType": "insert", "ns": {"coll": "roadmaps"}, "fullDocument": {"user_id": "user"}}
+    db = ScriptedStreams([[event, ValueError("bad BSON")], []])
+    invalidator = start_invalidator(db, cache)
+    assert wait_for(lambda: len(db.resume_points) == 2, timeout=5)
+    assert db.resume_points[1] is None
+    assert wait_for(lambda: invalidator.healthy, timeout=5)
+
+
+def test_handler_error_on_drop_event_keeps_stream_alive():
+    calls = []
+
+    def on_change(collection, user_id):
+        calls.append(user_id)
+        raise RuntimeError("handler failed")
+
+    drop = {"id": "1", "operationType": "drop", "ns": {"coll": "roadmaps"}}
+    db = ScriptedStreams([[drop]])
+    invalidator = ChangeStreamInvalidator(db, {"roadmaps": "user_id"}, on_change=on_change,
+                                          on_reset=lambda: None, max_retry_delay=0.05).start()
+    assert wait_for(lambda: calls == [None], timeout=5)
+    sleep(0.1)
+    assert invalidator.healthy
+    assert len(db.resume_points) == 1
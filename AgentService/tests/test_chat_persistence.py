@@ -0,0 +1,151 @@
+import threading
+from time import sleep
+
+import pytest
+
+pytest.importorskip("pymongo")
+from pymongo.errors import AutoReconnect, BulkWriteError, ServerSelectionTimeoutError
+
+from chat_persistence import ChatWriteBuffer
+from conftest import wait_for
+
+
+# In-memory stand-in for ai_chats that applies $push like Mongo.
+# `failures` is a list of exceptions raised by the next bulk_write calls;
+# apply_before_failure simulates a write that lands before its error is seen.
+class FakeChats:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.docs = {}
+        self.failures = []
+        self.apply_before_failure = False
+        self.bulk_writes = 0
+        self.lock = threading.Lock()
+
+    def _push(self, user_id, messages):
+        with self.lock:
+            self.docs.setdefault(user_id, []).extend(messages)
+
+    def bulk_write(self, operations, ordered=False):
+        sleep(self.delay)
+        self.bulk_writes += 1
+        failure = self.failures.pop(0) if self.failures else None
+        if failure is None or self.apply_before_failure:
+            for op in operations:
+                self._push(op._filter["userId"], op._doc["$push"]["messages"]["$each"])
+        if failure is not None:
+            raise failure
+
+    def update_one(self, query, update, upsert=False):
+        self._push(query["userId"], update["$push"]["messages"]["$each"])
+
+    def messages(self, user_id):
+        with self.lock:
+            return [message["n"] for message in self.docs.get(user_id, [])]
+
+
+def make_buffer(collection, **kwargs):
+    kwargs.setdefault("mode", "async")
+    kwargs.setdefault("flush_interval", 0.05)
+    return ChatWriteBuffer(collection, **kwargs)
+
+
+def test_overflow_keeps_message_order():
+    chats = FakeChats(delay=0.1)
+    buffer = make_buffer(chats, max_size=2, batch_size=1)
+    for n in range(5):
+        buffer.append("user", [{"n": n}])
+    buffer.flush()
+    assert wait_for(lambda: len(chats.messages("user")) == 5)
+    assert chats.messages("user") == [0, 1, 2, 3, 4]
+
+
+def test_overflow_writes_through_when_flusher_cannot_keep_up():
+    chats = FakeChats(delay=0.5)
+    buffer = make_buffer(chats, max_size=1, batch_size=1, flush_interval=0.01)
+    for n in range(4):
+        buffer.append("user", [{"n": n}])
+    buffer.flush()
+    assert wait_for(lambda: len(chats.messages("user")) == 4)
+    assert chats.messages("user") == [0, 1, 2, 3]
+    assert buffer.stats()["sync_fallbacks"] > 0
+
+
+def test_read_with_pending_never_duplicates_or_loses_messages():
+    chats = FakeChats(delay=0.005)
+    buffer = make_buffer(chats, max_size=1000, batch_size=5, flush_interval=0.01)
+    problems = []
+    stop = threading.Event()
+
+    def reader():
+        seen = 0
+        while not stop.is_set():
+            stored, pending = buffer.read_with_pending("user", lambda: chats.messages("user"))
+            combined = stored + [message["n"] for message in pending]
+            if combined != list(range(len(combined))) or len(combined) < seen:
+                problems.append(combined)
+            seen = len(combined)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    for n in range(200):
+        buffer.append("user", [{"n": n}])
+        sleep(0.001)
+    buffer.flush()
+    assert wait_for(lambda: len(chats.messages("user")) == 200)
+    stop.set()
+    thread.join()
+    assert problems == []
+
+
+def test_slow_flush_callback_does_not_block_flushing():
+    chats = FakeChats()
+    buffer = make_buffer(chats, max_size=4, batch_size=1, on_flush=lambda user_id: sleep(3))
+    for n in range(12):
+        buffer.append(f"user{n % 3}", [{"n": n}])
+        sleep(0.03)
+    assert wait_for(lambda: sum(len(chats.messages(f"user{i}")) for i in range(3)) == 12)
+    assert buffer.stats()["sync_fallbacks"] == 0
+
+
+def test_retries_when_no_server_was_reached():
+    chats = FakeChats()
+    chats.failures = [ServerSelectionTimeoutError("no primary")]
+    buffer = make_buffer(chats, mode="async_flush_on_shutdown")
+    buffer.append("user", [{"n": 0}])
+    buffer.close()
+    assert chats.messages("user") == [0]
+    assert chats.bulk_writes == 2
+
+
+def test_does_not_retry_when_outcome_is_unknown():
+    chats = FakeChats()
+    chats.failures = [AutoReconnect("connection reset")]
+    chats.apply_before_failure = True
+    buffer = make_buffer(chats, mode="async_flush_on_shutdown")
+    buffer.append("user", [{"n": 0}])
+    buffer.close()
+    assert chats.messages("user") == [0]
+    assert buffer.stats()["unconfirmed_messages"] == 1
+
+
+def test_retries_only_failed_users_of_a_bulk_write():
+    chats = FakeChats()
+    buffer = make_buffer(chats, mode="async_flush_on_shutdown", batch_size=10, flush_interval=1.0)
+
+    real_bulk_write = chats.bulk_write
+
+    def partial_failure(operations, ordered=False):
+        if chats.bulk_writes == 0:
+            chats.bulk_writes += 1
+            chats._push("ok", operations[0]._doc["$push"]["messages"]["$each"])
+            raise BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate"}],
+                                  "writeConcernErrors": []})
+        return real_bulk_write(operations, ordered)
+
+    chats.bulk_write = partial_failure
+    buffer.append("ok", [{"n": 0}])
+    buffer.append("retry", [{"n": 0}])
+    buffer.close()
+    assert chats.messages("ok") == [0]
+    assert chats.messages("retry") == [0]
@@ -1,5 +1,4 @@
 import os
-import google.generativeai as genai
 from datetime import datetime
 import requests
 import traceback
@@ -7,9 +6,19 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from cachetools import TTLCache
-import google.api_core.exceptions
-from time import sleep
+import sys
+import json
+import hashlib
+import threading
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, DESCENDING
+from pymongo.errors import PyMongoError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared.profiling import RequestProfiler, MongoStageListener, stage
+from shared.llm_gateway import get_gateway
+from shared.load_shedding import LoadShedder
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -17,6 +26,9 @@ app = Flask(__name__)
 # Correct CORS configuration
 CORS(app, origins="*", supports_credentials=True)
 
+# Opt-in request profiling and slow-request capture
+profiler = RequestProfiler(app, service_name="service2")
+
 
 
 # Configure rate limiter
@@ -26,12 +38,35 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"]
 )
 
-# Configure cache: 1 hour TTL, max 100 items
-cache = TTLCache(maxsize=100, ttl=3600)
+# Configure admission control for LLM-bound and DB-only endpoints
+shedder = LoadShedder()
+shedder.add_pool('llm', initial=int(os.getenv('LLM_POOL_MAX', '4')), min_limit=1,
+                 max_limit=int(os.getenv('LLM_POOL_MAX', '4')), target_latency=float(os.getenv('LLM_TARGET_LATENCY', '15')))
+shedder.add_pool('db', initial=8, min_limit=2, max_limit=16, target_latency=float(os.getenv('DB_TARGET_LATENCY', '0.5')))
+
+# Configure report store: reports older than REPORT_REFRESH_AFTER seconds are
+# still served but regenerated in the background
+REPORT_REFRESH_AFTER = int(os.getenv('REPORT_REFRESH_AFTER', str(7 * 24 * 3600)))
+ANALYSES_PAGE_SIZE = 10
+ANALYSES_MAX_PAGE_SIZE = 50
+refreshing_reports = set()
+refreshing_lock = threading.Lock()
+
+# Configure MongoDB; without it reports are generated on every request
+try:
+    mongo_client = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'), serverSelectionTimeoutMS=5000,
+                               event_listeners=[MongoStageListener()])
+    reports_collection = mongo_client['skilling_tracker']['ai_reports']
+    reports_collection.create_index([('user_id', 1), ('assessment_digest', 1)], unique=True, name='user_digest_unique')
+    reports_collection.create_index([('user_id', 1), ('_id', DESCENDING)], name='user_history_idx')
+    print("✅ MongoDB report store connected")
+except PyMongoError as e:
+    print(f"⚠️ MongoDB unavailable, report store disabled: {str(e)}")
+    reports_collection = None
 
-# Configure Gemini API
+# Configure Gemini through the shared LLM gateway, which also owns the response cache
 try:
-    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+    llm_gateway = get_gateway('service2')
     print("✅ Gemini API configured successfully")
 except Exception as e:
     print(f"❌ Failed to configure Gemini API: {str(e)}")
@@ -50,13 +85,18 @@ def health_check():
         print(f"❌ Health check error: {str(e)}")
         return jsonify({'error': f'Health check failed: {str(e)}'}), 500
 
-# Analyze student data or user message for career guidance
-def generate_career_advice(assessment_data=None, user_message=None, user_id=None):
-    cache_key = f"{user_id}:{user_message or str(assessment_data)}"
-    if cache_key in cache:
-        print(f"Cache hit for {cache_key}")
-        return cache[cache_key]
+FALLBACK_ADVICE = (
+    "🚀 FALLBACK CAREER ROADMAP\n"
+    "📋 Career Interests: Unknown due to API limitations\n"
+    "💡 Recommendations:\n"
+    "• Explore online courses on platforms like Coursera or Udemy to build skills.\n"
+    "• Research career paths on LinkedIn or Glassdoor.\n"
+    "• Network with professionals in your field of interest.\n"
+    "⚠️ Disclaimer: This is AI-generated advice. Always consult a career counselor for personalized guidance."
+)
 
+# Analyze student data or user message for career guidance
+def generate_career_advice(assessment_data=None, user_message=None, user_id=None, use_cache=True):
     try:
         content = ""
         if user_message:
@@ -83,41 +123,84 @@ def generate_career_advice(assessment_data=None, user_message=None, user_id=None
         f"End with a disclaimer suggesting they also consult a career counselor."
     )
 
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        max_retries = 3
-        retry_delay = 5  # Initial delay in seconds
-
-        for attempt in range(max_retries):
-            try:
-                response = model.generate_content(content)
-                result = response.text
-                cache[cache_key] = result
-                print(f"Gemini response: {result[:100]}...")  # Log first 100 chars
-                return result
-            except google.api_core.exceptions.ResourceExhausted as e:
-                if attempt < max_retries - 1:
-                    print(f"⚠️ Rate limit hit, retrying in {retry_delay}s... (Attempt {attempt + 1}/{max_retries})")
-                    sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    print(f"❌ Max retries reached: {str(e)}")
-                    raise
+        result = llm_gateway.generate(
+            content,
+            purpose='chat' if user_message else 'report',
+            use_cache=use_cache
+        )
+        print(f"Gemini response: {result[:100]}...")  # Log first 100 chars
+        return result
     except Exception as e:
         print(f"⚠️ Gemini error: {str(e)}")
         traceback.print_exc()
-        analysis_text = (
-            "🚀 FALLBACK CAREER ROADMAP\n"
-            "📋 Career Interests: Unknown due to API limitations\n"
-            "💡 Recommendations:\n"
-            "• Explore online courses on platforms like Coursera or Udemy to build skills.\n"
-            "• Research career paths on LinkedIn or Glassdoor.\n"
-            "• Network with professionals in your field of interest.\n"
-            "⚠️ Disclaimer: This is AI-generated advice. Always consult a career counselor for personalized guidance."
+        return FALLBACK_ADVICE
+
+# Chat answer returned instead of queueing when the LLM pool is saturated
+def shed_chat():
+    return jsonify({
+        'response': FALLBACK_ADVICE,
+        'type': 'fallback',
+        'confidence': '50%',
+        'source': 'Fallback',
+        'timestamp': datetime.now().isoformat(),
+    }), 200
+
+# Stable digest of an assessment, used to key stored reports
+def assessment_digest(assessment_data):
+    payload = json.dumps(assessment_data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Build the /api/ai-report payload from a report text
+def build_report_response(result, timestamp=None, cached=False):
+    return {
+        'analysis': result,
+        'type': 'fallback' if 'FALLBACK' in result else 'gemini_career_advice',
+        'confidence': '50%' if 'FALLBACK' in result else '85%',
+        'source': 'Fallback' if 'FALLBACK' in result else 'Gemini LLM',
+        'timestamp': (timestamp or datetime.now()).isoformat(),
+        'cached': cached,
+    }
+
+# Generate a report and persist it unless Gemini fell back
+def generate_and_store_report(user_id, assessment_data, digest, use_cache=True):
+    result = generate_career_advice(assessment_data=assessment_data, user_id=user_id, use_cache=use_cache)
+    if reports_collection is None or 'FALLBACK' in result:
+        return result
+
+    now = datetime.now()
+    try:
+        reports_collection.update_one(
+            {'user_id': user_id, 'assessment_digest': digest},
+            {
+                '$set': {'analysis': result, 'assessment': assessment_data, 'generated_at': now},
+                '$setOnInsert': {'created_at': now},
+            },
+            upsert=True
         )
-        cache[cache_key] = analysis_text
-        return analysis_text
+        print(f"✅ Stored report for user {user_id} ({digest[:12]})")
+    except PyMongoError as e:
+        print(f"⚠️ Could not store report for user {user_id}: {str(e)}")
+    return result
+
+# Regenerate a stale report off the request path, once per report at a time
+def refresh_report_in_background(user_id, assessment_data, digest):
+    key = (user_id, digest)
+    with refreshing_lock:
+        if key in refreshing_reports:
+            return
+        refreshing_reports.add(key)
 
-# Generate career roadmap
+    def refresh():
+        try:
+            # Skip the gateway cache so the refresh really calls Gemini
+            generate_and_store_report(user_id, assessment_data, digest, use_cache=False)
+        finally:
+            with refreshing_lock:
+                refreshing_reports.discard(key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+# Generate career roadmap; stored reports are served without taking an llm slot
 @app.route('/api/ai-report', methods=['GET'])
 @limiter.limit("10 per minute")
 def generate_report():
@@ -129,11 +212,12 @@ def generate_report():
             return jsonify({'error': 'User ID required'}), 400
 
         print(f"Fetching assessment from {os.getenv('BACKEND_URL')}/api/userinterest/status")
-        assessment_response = requests.get(
-            f"{os.getenv('BACKEND_URL', 'http://localhost:3000')}/api/userinterest/status",
-            params={'userId': user_id},
-            cookies=request.cookies
-        )
+        with stage("node_fetch"):
+            assessment_response = requests.get(
+                f"{os.getenv('BACKEND_URL', 'http://localhost:3000')}/api/userinterest/status",
+                params={'userId': user_id},
+                cookies=request.cookies
+            )
         print(f"Assessment response status: {assessment_response.status_code}")
         print(f"Assessment response: {assessment_response.json()}")
 
@@ -148,15 +232,33 @@ def generate_report():
             }), 500
 
         assessment_data = assessment_response.json().get('mentalHealthAnswers', {})
+        digest = assessment_digest(assessment_data)
 
-        result = generate_career_advice(assessment_data=assessment_data, user_id=user_id)
-        response_data = {
-            'analysis': result,
-            'type': 'fallback' if 'FALLBACK' in result else 'gemini_career_advice',
-            'confidence': '50%' if 'FALLBACK' in result else '85%',
-            'source': 'Fallback' if 'FALLBACK' in result else 'Gemini LLM',
-            'timestamp': datetime.now().isoformat(),
-        }
+        stored = None
+        if reports_collection is not None:
+            with shedder.acquire('db') as admitted:
+                if not admitted:
+                    return shedder.busy_response('db')
+                try:
+                    stored = reports_collection.find_one(
+                        {'user_id': user_id, 'assessment_digest': digest},
+                        {'analysis': 1, 'generated_at': 1}
+                    )
+                except PyMongoError as e:
+                    print(f"⚠️ Report store lookup failed: {str(e)}")
+
+        if stored:
+            print(f"Report store hit for user {user_id} ({digest[:12]})")
+            age = (datetime.now() - stored['generated_at']).total_seconds()
+            if age > REPORT_REFRESH_AFTER:
+                refresh_report_in_background(user_id, assessment_data, digest)
+            response_data = build_report_response(stored['analysis'], stored['generated_at'], cached=True)
+        else:
+            with shedder.acquire('llm') as admitted:
+                if not admitted:
+                    return shedder.busy_response('llm')
+                result = generate_and_store_report(user_id, assessment_data, digest)
+            response_data = build_report_response(result)
 
         print(f"Returning report: {response_data}")
         return jsonify(response_data), 200
@@ -174,6 +276,7 @@ def generate_report():
 # Handle chat messages
 @app.route('/api/ai-chat', methods=['POST'])
 @limiter.limit("10 per minute")
+@shedder.limit('llm', fallback=shed_chat)
 def chat():
     try:
         data = request.get_json()
@@ -210,6 +313,7 @@ def chat():
 # Fetch analysis history
 @app.route('/api/analyses', methods=['GET'])
 @limiter.limit("10 per minute")
+@shedder.limit('db')
 def get_analyses():
     try:
         user_id = request.args.get('userId', '').strip()
@@ -218,29 +322,48 @@ def get_analyses():
             print("Error: User ID missing")
             return jsonify({'error': 'User ID required'}), 400
 
-        # Mock history updated for career advice
+        if reports_collection is None:
+            return jsonify({'error': 'Report history unavailable'}), 503
+
+        try:
+            limit = min(max(int(request.args.get('limit', ANALYSES_PAGE_SIZE)), 1), ANALYSES_MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+
+        # Cursor is the _id of the last report on the previous page (newest first)
+        query = {'user_id': user_id}
+        cursor = request.args.get('cursor', '').strip()
+        if cursor:
+            try:
+                query['_id'] = {'$lt': ObjectId(cursor)}
+            except InvalidId:
+                return jsonify({'error': 'Invalid cursor'}), 400
+
+        reports = list(
+            reports_collection.find(query, {'analysis': 1, 'generated_at': 1, 'created_at': 1})
+            .sort('_id', DESCENDING)
+            .limit(limit + 1)
+        )
+        next_cursor = str(reports[limit - 1]['_id']) if len(reports) > limit else None
+
         history = [
             {
-                'userInput': {'text': 'What skills do I need for a career in software engineering?'},
+                'id': str(report['_id']),
+                'userInput': {'text': 'Career assessment report'},
                 'aiResponse': {
-                    'response': (
-                        "To pursue a career in software engineering, consider the following:\n"
-                        "• Learn programming languages like Python, Java, or JavaScript.\n"
-                        "• Build projects on GitHub to showcase your skills.\n"
-                        "• Explore certifications like AWS Certified Developer or CompTIA.\n"
-                        "⚠️ Disclaimer: This is AI-generated advice. Consult a career counselor for personalized guidance."
-                    ),
+                    'response': report['analysis'],
                     'type': 'gemini_career_advice',
                     'confidence': '85%',
                     'source': 'Gemini LLM',
-                    'timestamp': datetime.now().isoformat(),
+                    'timestamp': report['generated_at'].isoformat(),
                 },
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': report['created_at'].isoformat(),
             }
+            for report in reports[:limit]
         ]
 
-        print(f"Returning history: {history}")
-        return jsonify({'success': True, 'data': history}), 200
+        print(f"Returning {len(history)} analyses for userId: {user_id}")
+        return jsonify({'success': True, 'data': history, 'nextCursor': next_cursor}), 200
     except Exception as e:
         print(f"❌ Error fetching analyses: {str(e)}")
         traceback.print_exc()
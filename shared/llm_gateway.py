@@ -0,0 +1,332 @@
+import os
+import hashlib
+import threading
+import logging
+import traceback
+from collections import deque, Counter
+from time import sleep, monotonic
+from cachetools import TTLCache
+import google.generativeai as genai
+import google.api_core.exceptions
+import requests
+
+from shared.profiling import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODELS = ["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.0-flash", "gemini-2.0-pro"]
+
+
+# Raised when the local request budget or Gemini's own quota is exhausted
+class QuotaExceeded(Exception):
+    pass
+
+
+# Raised when no model could produce a response
+class LLMUnavailable(Exception):
+    pass
+
+
+# Single entry point for Gemini calls.
+#
+# Owns one GenerativeModel per model name, a response cache keyed by prompt,
+# coalescing of identical in-flight prompts, and a requests-per-minute budget
+# with per-service accounting. Services call generate() instead of genai.
+class LLMGateway:
+    def __init__(self, api_key=None, models=None, cache_size=500, cache_ttl=3600,
+                 rpm_limit=0, max_retries=3, retry_delay=5):
+        genai.configure(api_key=api_key)
+
+        self.models = list(models or DEFAULT_MODELS)
+        self.rpm_limit = rpm_limit
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._model_pool = {}
+        self._pool_lock = threading.Lock()
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._cache_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._calls = deque()
+        self._quota_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._stats = Counter()
+        self._usage = {}
+
+    # Generate text for a prompt, served from cache or a coalesced call when possible.
+    # validate(text) may raise to reject a response; rejected responses are not cached.
+    def generate(self, prompt, purpose="default", service="local", use_cache=True, validate=None):
+        key = hashlib.sha256(f"{','.join(self.models)}\n{prompt}".encode("utf-8")).hexdigest()
+
+        if use_cache:
+            with self._cache_lock:
+                cached = self._cache.get(key)
+            if cached is not None:
+                self._count(service, purpose, "cache_hits")
+                return cached
+
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._inflight[key] = call
+
+        if not leader:
+            self._count(service, purpose, "coalesced")
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            text = self._call_model(prompt, service, purpose)
+            if validate:
+                validate(text)
+            with self._cache_lock:
+                self._cache[key] = text
+            call["result"] = text
+            return text
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            call["done"].set()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            usage = {name: dict(counts) for name, counts in self._usage.items()}
+        with self._quota_lock:
+            self._expire_calls()
+            stats["calls_last_minute"] = len(self._calls)
+        with self._cache_lock:
+            stats["cache_entries"] = len(self._cache)
+        stats["rpm_limit"] = self.rpm_limit
+        stats["models_pooled"] = list(self._model_pool)
+        stats["usage"] = usage
+        return stats
+
+    def _call_model(self, prompt, service, purpose):
+        retry_delay = self.retry_delay
+        candidates = list(self.models)
+        discovered = False
+        attempt = 0
+        while True:
+            if not candidates:
+                # Preferred models are exhausted; ask Gemini once for another
+                if discovered:
+                    break
+                discovered = True
+                candidates = self._discover_models(exclude=self.models)
+                continue
+
+            model_name = candidates[0]
+            model = self._get_model(model_name)
+            if model is None:
+                candidates.pop(0)
+                continue
+
+            self._reserve_quota(service, purpose)
+            attempt += 1
+            try:
+                with stage("model_attempt", model=model_name, attempt=attempt):
+                    response = model.generate_content(prompt)
+                text = response.text.strip()
+                self._record_usage(service, purpose, response)
+                return text
+            except google.api_core.exceptions.ResourceExhausted:
+                self._count(service, purpose, "quota_errors")
+                if attempt >= self.max_retries:
+                    logger.error("❌ Exhausted retries due to quota limit")
+                    raise QuotaExceeded("Gemini quota exhausted")
+                logger.warning(f"⚠️ Rate limit hit, retrying in {retry_delay}s...")
+                sleep(retry_delay)
+                retry_delay *= 2
+            except Exception as e:
+                self._count(service, purpose, "model_errors")
+                logger.error(f"❌ Model {model_name} error: {str(e)}")
+                if attempt >= self.max_retries:
+                    raise LLMUnavailable(str(e))
+                candidates.pop(0)
+
+        raise LLMUnavailable("No Gemini models available")
+
+    # Reuse one GenerativeModel per name for the life of the process
+    def _get_model(self, model_name):
+        with self._pool_lock:
+            if model_name not in self._model_pool:
+                try:
+                    self._model_pool[model_name] = genai.GenerativeModel(model_name)
+                    logger.info(f"✅ Using model: {model_name}")
+                except Exception as e:
+                    logger.warning(f"⚠️ Model {model_name} not available: {str(e)}")
+                    self._model_pool[model_name] = None
+            return self._model_pool[model_name]
+
+    def _discover_models(self, exclude):
+        try:
+            # list_models() names are "models/<name>"; configured names are bare
+            models = [
+                model.name for model in genai.list_models()
+                if 'generateContent' in model.supported_generation_methods
+                and model.name.split("/", 1)[-1] not in exclude
+            ]
+            logger.info(f"🔄 Discovered fallback models: {models}")
+            return models[:1]
+        except Exception as e:
+            logger.error(f"❌ Error listing models: {str(e)}")
+            traceback.print_exc()
+            return []
+
+    def _expire_calls(self):
+        cutoff = monotonic() - 60
+        while self._calls and self._calls[0] < cutoff:
+            self._calls.popleft()
+
+    def _reserve_quota(self, service, purpose):
+        with self._quota_lock:
+            self._expire_calls()
+            if self.rpm_limit and len(self._calls) >= self.rpm_limit:
+                rejected = True
+            else:
+                rejected = False
+                self._calls.append(monotonic())
+        if rejected:
+            self._count(service, purpose, "quota_rejected")
+            raise QuotaExceeded(f"Local Gemini budget of {self.rpm_limit} requests/minute reached")
+        self._count(service, purpose, "model_calls")
+
+    def _record_usage(self, service, purpose, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        self._count(service, purpose, "prompt_tokens", getattr(usage, "prompt_token_count", 0) or 0)
+        self._count(service, purpose, "output_tokens", getattr(usage, "candidates_token_count", 0) or 0)
+
+    def _count(self, service, purpose, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+            self._usage.setdefault(f"{service}:{purpose}", Counter())[key] += amount
+
+
+# Client for a gateway running as a local sidecar (python -m shared.llm_gateway)
+class RemoteLLMGateway:
+    def __init__(self, url, service="remote", timeout=120):
+        self.url = url.rstrip("/")
+        self.service = service
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    # The sidecar caches before validate() runs here, so a rejected response
+    # is retried once past the cache; the fresh answer replaces the bad entry
+    def generate(self, prompt, purpose="default", service=None, use_cache=True, validate=None):
+        text = self._post(prompt, purpose, service, use_cache)
+        if validate:
+            try:
+                validate(text)
+            except Exception:
+                if not use_cache:
+                    raise
+                logger.warning(f"⚠️ Gateway response for {purpose} failed validation, retrying uncached")
+                text = self._post(prompt, purpose, service, False)
+                validate(text)
+        return text
+
+    def _post(self, prompt, purpose, service, use_cache):
+        with stage("llm_gateway", purpose=purpose):
+            try:
+                response = self._session.post(
+                    f"{self.url}/generate",
+                    json={"prompt": prompt, "purpose": purpose, "service": service or self.service, "use_cache": use_cache},
+                    timeout=self.timeout
+                )
+            except requests.exceptions.RequestException as e:
+                raise LLMUnavailable(f"LLM gateway unreachable: {str(e)}")
+
+        if response.status_code == 429:
+            raise QuotaExceeded(response.json().get("message", "Quota exceeded"))
+        if response.status_code != 200:
+            raise LLMUnavailable(f"LLM gateway returned status {response.status_code}")
+        return response.json()["text"]
+
+    def stats(self):
+        try:
+            response = self._session.get(f"{self.url}/stats", timeout=5)
+            response.raise_for_status()
+            return response.json().get("data", {})
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"⚠️ LLM gateway stats unavailable: {str(e)}")
+            return {"sidecar": self.url, "available": False, "error": str(e)}
+
+
+def _gateway_from_env(api_key=None):
+    return LLMGateway(
+        api_key=api_key or os.getenv("GEMINI_API_KEY"),
+        models=[m.strip() for m in os.getenv("GEMINI_MODELS", "").split(",") if m.strip()] or None,
+        cache_size=int(os.getenv("LLM_CACHE_SIZE", "500")),
+        cache_ttl=int(os.getenv("LLM_CACHE_TTL", "3600")),
+        rpm_limit=int(os.getenv("GEMINI_RPM_LIMIT", "0")),
+    )
+
+
+# Use the sidecar when LLM_GATEWAY_URL is set, otherwise an in-process gateway
+def get_gateway(service, api_key=None):
+    url = os.getenv("LLM_GATEWAY_URL")
+    if url:
+        logger.info(f"✅ Using LLM gateway sidecar at {url}")
+        return RemoteLLMGateway(url, service=service)
+    return _gateway_from_env(api_key)
+
+
+# Flask app exposing an in-process gateway to other local services
+def create_gateway_app(gateway):
+    from flask import Flask, request, jsonify
+
+    app = Flask(__name__)
+
+    @app.route("/generate", methods=["POST"])
+    def generate():
+        data = request.get_json() or {}
+        prompt = data.get("prompt")
+        if not prompt:
+            return jsonify({"success": False, "message": "prompt is required"}), 400
+        try:
+            text = gateway.generate(
+                prompt,
+                purpose=data.get("purpose", "default"),
+                service=data.get("service", "remote"),
+                use_cache=data.get("use_cache", True)
+            )
+        except QuotaExceeded as e:
+            return jsonify({"success": False, "message": str(e)}), 429
+        except LLMUnavailable as e:
+            return jsonify({"success": False, "message": str(e)}), 503
+        return jsonify({"success": True, "text": text}), 200
+
+    @app.route("/stats", methods=["GET"])
+    def stats():
+        return jsonify({"success": True, "data": gateway.stats()}), 200
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        return jsonify({"status": "LLM gateway running"}), 200
+
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    port = int(os.getenv("LLM_GATEWAY_PORT", "5010"))
+    gateway_app = create_gateway_app(_gateway_from_env())
+    logger.info(f"🚀 Starting LLM gateway on port {port}...")
+    try:
+        from waitress import serve
+        serve(gateway_app, host="127.0.0.1", port=port, threads=int(os.getenv("LLM_GATEWAY_THREADS", "16")))
+    except ImportError:
+        logger.warning("⚠️ Waitress not installed. Falling back to Flask dev server")
+        gateway_app.run(host="127.0.0.1", port=port, threaded=True)
@@ -0,0 +1,170 @@
+import math
+import threading
+import logging
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+from flask import jsonify
+
+logger = logging.getLogger(__name__)
+
+
+# Concurrency limit tuned from observed latency (AIMD).
+#
+# Each completion slower than target_latency shrinks the limit multiplicatively;
+# completions within target while the pool is near its limit grow it by about
+# one slot per limit's worth of requests.
+class AdaptiveLimiter:
+    def __init__(self, name, initial, min_limit, max_limit, target_latency, backoff=0.9, smoothing=0.2):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.inflight = 0
+        self.smoothed_latency = None
+        self.accepted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.inflight >= int(self.limit):
+                self.rejected += 1
+                return None
+            self.inflight += 1
+            self.accepted += 1
+            # Remember whether the pool was busy when this request started
+            return self.inflight >= int(self.limit)
+
+    def release(self, latency, was_saturated):
+        with self._lock:
+            self.inflight -= 1
+            if self.smoothed_latency is None:
+                self.smoothed_latency = latency
+            else:
+                self.smoothed_latency += self.smoothing * (latency - self.smoothed_latency)
+
+            old_limit = int(self.limit)
+            if latency > self.target_latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            elif was_saturated:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) != old_limit:
+                logger.info(f"🎚️ {self.name} concurrency limit {old_limit} -> {int(self.limit)} "
+                            f"(latency {latency:.2f}s, target {self.target_latency}s)")
+
+    # Seconds a rejected client should wait before retrying
+    def retry_after(self):
+        with self._lock:
+            latency = self.smoothed_latency or self.target_latency
+        return max(1, math.ceil(latency))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "inflight": self.inflight,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "smoothed_latency_s": round(self.smoothed_latency, 3) if self.smoothed_latency is not None else None,
+                "target_latency_s": self.target_latency,
+            }
+
+
+# Per-endpoint-class admission control for Flask views.
+#
+# Views decorated with @shedder.limit("llm") share one AdaptiveLimiter; when it
+# is full the view is not run and the client gets a fast 503 with Retry-After,
+# or the fallback response if one is given. Views that only sometimes need a
+# pool wrap that part in `with shedder.acquire("llm") as admitted`.
+class LoadShedder:
+    def __init__(self):
+        self.pools = {}
+
+    def add_pool(self, name, initial, min_limit, max_limit, target_latency):
+        self.pools[name] = AdaptiveLimiter(name, initial, min_limit, max_limit, target_latency)
+        return self.pools[name]
+
+    def limit(self, pool_name, fallback=None):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                with self.acquire(pool_name) as admitted:
+                    if not admitted:
+                        return fallback() if fallback is not None else self.busy_response(pool_name)
+                    return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Hold a pool slot for the body; yields False without one when the pool is full
+    @contextmanager
+    def acquire(self, pool_name):
+        pool = self.pools[pool_name]
+        was_saturated = pool.try_acquire()
+        if was_saturated is None:
+            logger.warning(f"⚠️ Shedding request: {pool_name} pool at limit {int(pool.limit)}")
+            yield False
+            return
+
+        start = perf_counter()
+        try:
+            yield True
+        finally:
+            pool.release(perf_counter() - start, was_saturated)
+
+    # Admit a streamed response body: the slot is held until the WSGI server
+    # closes the iterable. Returns None when the pool is full.
+    def admit_stream(self, pool_name, chunks):
+        pool = self.pools[pool_name]
+        was_saturated = pool.try_acquire()
+        if was_saturated is None:
+            logger.warning(f"⚠️ Shedding request: {pool_name} pool at limit {int(pool.limit)}")
+            return None
+        return _HeldStream(chunks, pool, was_saturated)
+
+    def busy_response(self, pool_name):
+        response = jsonify({
+            "success": False,
+            "message": "Service is busy, please retry shortly",
+        })
+        response.status_code = 503
+        response.headers["Retry-After"] = str(self.pools[pool_name].retry_after())
+        return response
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+# Iterable wrapper that releases a pool slot once, on exhaustion or close()
+class _HeldStream:
+    def __init__(self, chunks, pool, was_saturated):
+        self._chunks = iter(chunks)
+        self._pool = pool
+        self._was_saturated = was_saturated
+        self._start = perf_counter()
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            if hasattr(self._chunks, "close"):
+                self._chunks.close()
+        finally:
+            self._pool.release(perf_counter() - self._start, self._was_saturated)
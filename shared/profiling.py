@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import random
+import threading
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter, sleep
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+# Per-thread stage log for the request currently being served
+_state = threading.local()
+
+
+def _current_stages():
+    return getattr(_state, "stages", None)
+
+
+# Record a finished stage against the current request (no-op outside requests)
+def record_stage(name, duration_ms, **detail):
+    stages = _current_stages()
+    if stages is None:
+        return
+    entry = {"stage": name, "ms": round(duration_ms, 2)}
+    entry.update(detail)
+    stages.append(entry)
+
+
+# Time a block of work as a named stage of the current request
+@contextmanager
+def stage(name, **detail):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, (perf_counter() - start) * 1000, **detail)
+
+
+# Sampling profiler for a single thread.
+# Stacks are aggregated in collapsed "frame;frame;frame count" form, which
+# flamegraph.pl, speedscope and inferno read directly.
+class SamplingProfiler:
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+            del frame
+            sleep(self.interval)
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+# JSON provider that times response serialization as its own stage
+class ProfiledJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with stage("serialization"):
+            return super().dumps(obj, **kwargs)
+
+
+# pymongo command listener that records every Mongo round trip as a stage
+try:
+    from pymongo import monitoring
+
+    class MongoStageListener(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            record_stage(f"mongo:{event.command_name}", event.duration_micros / 1000)
+
+        def failed(self, event):
+            record_stage(f"mongo:{event.command_name}", event.duration_micros / 1000, failed=True)
+except ImportError:
+    MongoStageListener = None
+
+
+# Opt-in per-request profiling and slow-request capture for a Flask app.
+#
+# A request is profiled when it carries X-Profile matching PROFILE_ADMIN_TOKEN,
+# or when it is picked by PROFILE_SAMPLE_RATE. Any request slower than
+# SLOW_REQUEST_MS gets a JSON line with its stage breakdown in SLOW_REQUEST_LOG.
+class RequestProfiler:
+    def __init__(self, app=None, service_name="service"):
+        self.service_name = service_name
+        self.admin_token = os.getenv("PROFILE_ADMIN_TOKEN", "")
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.interval = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+        self.profile_dir = os.getenv("PROFILE_DIR", "profiles")
+        self.slow_request_ms = float(os.getenv("SLOW_REQUEST_MS", "2000"))
+        self.slow_request_log = os.getenv("SLOW_REQUEST_LOG", os.path.join(self.profile_dir, "slow_requests.jsonl"))
+        self._log_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.json = ProfiledJSONProvider(app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _should_profile(self):
+        header = request.headers.get("X-Profile", "")
+        if self.admin_token and header == self.admin_token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _before_request(self):
+        _state.stages = []
+        _state.start = perf_counter()
+        _state.profiler = None
+        if self._should_profile():
+            _state.profiler = SamplingProfiler(threading.get_ident(), self.interval)
+            _state.profiler.start()
+
+    def _after_request(self, response):
+        stages = _current_stages()
+        if stages is None:
+            return response
+
+        duration_ms = (perf_counter() - _state.start) * 1000
+        profile_path = self._finish_profile()
+        if profile_path:
+            response.headers["X-Profile-File"] = os.path.basename(profile_path)
+
+        if duration_ms >= self.slow_request_ms:
+            self._log_slow_request(response, duration_ms, stages, profile_path)
+        return response
+
+    def _teardown_request(self, exc):
+        # Stop a profiler left running when the view raised
+        self._finish_profile()
+        _state.stages = None
+
+    def _finish_profile(self):
+        profiler = getattr(_state, "profiler", None)
+        if profiler is None:
+            return None
+        _state.profiler = None
+        profiler.stop()
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            filename = (f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{self.service_name}-"
+                        f"{(request.endpoint or 'unknown').replace('.', '_')}.folded")
+            path = os.path.join(self.profile_dir, filename)
+            profiler.write_collapsed(path)
+            logger.info(f"🔥 Request profile written to {path} ({sum(profiler.samples.values())} samples)")
+            return path
+        except OSError as e:
+            logger.error(f"❌ Could not write request profile: {str(e)}")
+            return None
+
+    def _log_slow_request(self, response, duration_ms, stages, profile_path):
+        stage_totals = {}
+        for entry in stages:
+            total = stage_totals.setdefault(entry["stage"], {"count": 0, "ms": 0.0})
+            total["count"] += 1
+            total["ms"] = round(total["ms"] + entry["ms"], 2)
+        accounted = sum(entry["ms"] for entry in stages)
+
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "service": self.service_name,
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "duration_ms": round(duration_ms, 2),
+            "unaccounted_ms": round(max(duration_ms - accounted, 0), 2),
+            "stage_totals": stage_totals,
+            "stages": stages,
+            "profile": profile_path,
+        }
+        breakdown = ", ".join(f"{name}={total['ms']:.0f}ms" for name, total in stage_totals.items())
+        logger.warning(f"🐢 Slow request {request.method} {request.path}: {duration_ms:.0f}ms ({breakdown})")
+        try:
+            os.makedirs(os.path.dirname(self.slow_request_log) or ".", exist_ok=True)
+            with self._log_lock, open(self.slow_request_log, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            logger.error(f"❌ Could not write slow request log: {str(e)}")